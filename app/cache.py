@@ -0,0 +1,11 @@
+from redis import asyncio as aioredis
+
+from app.config import REDIS_URL, REDIS_TIMEOUT
+
+# Shared Redis client; caching is disabled when REDIS_URL is not set. Short
+# timeouts let requests fall back to the database quickly when Redis is down.
+redis_client = aioredis.from_url(
+    REDIS_URL,
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT,
+) if REDIS_URL else None
@@ -1,19 +1,117 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker , declarative_base
+import asyncio
 
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import StaticPool
+
+
+from app.config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, TIMESCALEDB_ENABLED
+from app.timescale import setup_timescale
+
+
+def async_database_url(url: str):
+    # asyncpg takes `ssl` instead of libpq's `sslmode`
+    url = make_url(url)
+    if url.drivername == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        if "sslmode" in url.query:
+            url = url.difference_update_query(["sslmode"]).update_query_dict(
+                {"ssl": url.query["sslmode"]}
+            )
+    if url.drivername == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+def _create_engine(url: str):
+    url = async_database_url(url)
+    if url.get_backend_name() == "sqlite":
+        # In-process SQLite (used by the tests) shares one connection, so an
+        # in-memory database lives as long as the engine
+        engine = create_async_engine(
+            url,
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False},
+        )
+        _emit_sqlite_begin(engine)
+        return engine
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=1800,
+        query_cache_size=1200,
+    )
+
+
+def _emit_sqlite_begin(engine):
+    # The sqlite3 driver manages transactions on its own and breaks SAVEPOINTs;
+    # let SQLAlchemy emit BEGIN instead
+    @event.listens_for(engine.sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
 
-from app.config import DATABASE_URL
 
 # Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = _create_engine(DATABASE_URL)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 Base = declarative_base()
-Base.metadata.create_all(bind=engine)
+
+
+# create_all skips tables that already exist, so schema changes made since a
+# database was created are applied here. Every statement is idempotent.
+SCHEMA_UPGRADES = [
+    # Covering index from DBSensorData.__table_args__
+    """
+    CREATE INDEX IF NOT EXISTS ix_sensor_server_time ON sensor_data (server_ulid, "timestamp" DESC)
+    INCLUDE (temperature, humidity, voltage, current)
+    """,
+    # servers.last_seen became timestamptz set by Postgres; earlier versions
+    # stored the app's naive UTC time
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'servers'
+                AND column_name = 'last_seen' AND data_type = 'timestamp without time zone'
+        ) THEN
+            ALTER TABLE servers ALTER COLUMN last_seen TYPE timestamptz USING last_seen AT TIME ZONE 'UTC';
+        END IF;
+    END
+    $$
+    """,
+    "ALTER TABLE servers ALTER COLUMN last_seen SET DEFAULT now()",
+]
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == "postgresql":
+            for statement in SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
+        if TIMESCALEDB_ENABLED:
+            await setup_timescale(conn)
+
+
+async def warm_up_pool():
+    # Open the whole pool up front so the first requests don't pay for connecting
+    if isinstance(engine.pool, StaticPool):
+        return
+    connections = await asyncio.gather(*(engine.connect() for _ in range(DB_POOL_SIZE)))
+    for conn in connections:
+        await conn.close()
+
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
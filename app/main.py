@@ -1,14 +1,34 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from app.routes import auth, servers, sensor_data
-from app.database import engine
+from app.cache import redis_client
+from app.config import CREATE_TABLES_ON_STARTUP
+from app.database import engine, init_db, warm_up_pool
 from app.models.models import Base
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables unless the schema is managed outside the app
+    if CREATE_TABLES_ON_STARTUP:
+        await init_db()
+    await warm_up_pool()
+    yield
+    await engine.dispose()
+    if redis_client is not None:
+        await redis_client.aclose()
+
 
 # FastAPI App
-app = FastAPI(title="IoT Backend API", version="0.0.1")
+app = FastAPI(
+    title="IoT Backend API",
+    version="0.0.1",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # Include routers
 app.include_router(auth.router)
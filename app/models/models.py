@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, String, Float, DateTime, Boolean, ForeignKey, BigInteger, Index, MetaData, Table, func
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -22,7 +22,7 @@ class DBServer(Base):
     server_ulid = Column(String, primary_key=True, index=True)
     server_name = Column(String)
     owner_id = Column(String, ForeignKey("users.id"))
-    last_seen = Column(DateTime)
+    last_seen = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     owner = relationship("DBUser", back_populates="servers")
     sensor_data = relationship("DBSensorData", back_populates="server")
@@ -33,10 +33,47 @@ class DBSensorData(Base):
     
     id = Column(String, primary_key=True, index=True)
     server_ulid = Column(String, ForeignKey("servers.server_ulid"))
-    timestamp = Column(DateTime, index=True)
+    # Part of the primary key so sensor_data can be partitioned by time (TimescaleDB)
+    timestamp = Column(DateTime, primary_key=True, index=True)
     temperature = Column(Float, nullable=True)
     humidity = Column(Float, nullable=True)
     voltage = Column(Float, nullable=True)
     current = Column(Float, nullable=True)
     
     server = relationship("DBServer", back_populates="sensor_data")
+    
+    # Serves per-server reads ordered by time from the index alone
+    __table_args__ = (
+        Index(
+            "ix_sensor_server_time",
+            server_ulid,
+            timestamp.desc(),
+            postgresql_include=["temperature", "humidity", "voltage", "current"],
+        ),
+    )
+
+
+# TimescaleDB continuous aggregates over sensor_data (created in app/timescale.py).
+# They use their own MetaData so create_all never creates them as plain tables.
+views_metadata = MetaData()
+
+
+def _sensor_data_rollup(name):
+    return Table(
+        name,
+        views_metadata,
+        Column("bucket", DateTime),
+        Column("server_ulid", String),
+        *(
+            column
+            for sensor in ("temperature", "humidity", "voltage", "current")
+            for column in (Column(f"{sensor}_sum", Float), Column(f"{sensor}_count", BigInteger))
+        ),
+    )
+
+
+SENSOR_DATA_ROLLUPS = {
+    "minute": _sensor_data_rollup("sensor_data_1m"),
+    "hour": _sensor_data_rollup("sensor_data_1h"),
+    "day": _sensor_data_rollup("sensor_data_1d"),
+}
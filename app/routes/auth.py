@@ -1,9 +1,11 @@
 from typing import Annotated
 from datetime import timedelta
+import asyncio
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from ulid import ulid
 
 from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
@@ -21,32 +23,35 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 
 
 @router.post("/register", response_model=User)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = get_user(db, username=user.username)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await get_user(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user.password)
-    db_user = DBUser(
-        id=str(ulid),
-        username=user.username,
-        email=user.email,
-        full_name=user.full_name,
-        hashed_password=hashed_password
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)
+    # RETURNING gives back the stored row without a separate refresh query
+    result = await db.execute(
+        insert(DBUser)
+        .values(
+            id=str(ulid()),
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name,
+            hashed_password=hashed_password
+        )
+        .returning(DBUser)
     )
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    db_user = result.scalar_one()
+    await db.commit()
     return db_user
 
 
 @router.post("/login", response_model=Token)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
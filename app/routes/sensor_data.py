@@ -1,29 +1,68 @@
 from datetime import datetime, timedelta
+import functools
 from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy import func, select
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import bindparam, func, insert, null, or_, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from ulid import ulid
 
+from app.config import TIMESCALEDB_ENABLED
 from app.database import get_db
-from app.models.models import DBSensorData, DBServer, DBUser
-from app.schemas.schemas import SensorDataPost, SensorDataResponse
+from app.models.models import DBSensorData, DBServer, DBUser, SENSOR_DATA_ROLLUPS
+from app.schemas.schemas import SensorDataPost, SensorDataResponse, naive_utc
 from app.security.auth import get_current_active_user
 
 router = APIRouter(tags=["sensor_data"])
 
+# Statements reused across requests; values are passed as bind parameters
+# Postgres stamps last_seen itself; RETURNING tells whether the server exists
+TOUCH_SERVER = (
+    update(DBServer)
+    .where(DBServer.server_ulid == bindparam("ulid"))
+    .values(last_seen=func.now())
+    .returning(DBServer.server_ulid)
+    .execution_options(synchronize_session=False)
+)
+SENSOR_DATA_BY_OWNER = (
+    select(
+        DBSensorData.timestamp,
+        DBSensorData.temperature,
+        DBSensorData.humidity,
+        DBSensorData.voltage,
+        DBSensorData.current
+    )
+    .join(DBServer)
+    .where(DBServer.owner_id == bindparam("owner_id"))
+)
+
+# Sensor columns and aggregation buckets accepted by GET /data
+SENSOR_COLUMNS = {
+    "temperature": DBSensorData.temperature,
+    "humidity": DBSensorData.humidity,
+    "voltage": DBSensorData.voltage,
+    "current": DBSensorData.current
+}
+AGGREGATIONS = {
+    "minute": func.date_trunc('minute', DBSensorData.timestamp),
+    "hour": func.date_trunc('hour', DBSensorData.timestamp),
+    "day": func.date_trunc('day', DBSensorData.timestamp)
+}
+BUCKET_WIDTHS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1)
+}
+
 
 @router.post("/data", status_code=status.HTTP_201_CREATED)
-async def post_sensor_data(data: SensorDataPost, db: Session = Depends(get_db)):
-    # Check if server exists
-    server = db.query(DBServer).filter(DBServer.server_ulid == data.server_ulid).first()
-    if not server:
+async def post_sensor_data(data: SensorDataPost, db: AsyncSession = Depends(get_db)):
+    # Update last seen timestamp, which also checks that the server exists
+    result = await db.execute(TOUCH_SERVER, {"ulid": data.server_ulid})
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Server not found")
     
-    # Update last seen timestamp
-    server.last_seen = datetime.now()
-    
     # Create sensor data entry
     db_sensor_data = DBSensorData(
         id=str(ulid()),
@@ -36,11 +75,41 @@ async def post_sensor_data(data: SensorDataPost, db: Session = Depends(get_db)):
     )
     
     db.add(db_sensor_data)
-    db.commit()
+    await db.commit()
     
     return {"message": "Data recorded successfully"}
 
 
+@router.post("/data/bulk", status_code=status.HTTP_201_CREATED)
+async def post_sensor_data_bulk(
+    data: Annotated[List[SensorDataPost], Body(min_length=1)],
+    db: AsyncSession = Depends(get_db)
+):
+    server_ulids = {item.server_ulid for item in data}
+    
+    # Touch every server's last seen timestamp; the ones not returned don't exist
+    result = await db.execute(
+        update(DBServer)
+        .where(DBServer.server_ulid.in_(server_ulids))
+        .values(last_seen=func.now())
+        .returning(DBServer.server_ulid)
+        .execution_options(synchronize_session=False)
+    )
+    missing = server_ulids - set(result.scalars().all())
+    if missing:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail=f"Server not found: {', '.join(sorted(missing))}")
+    
+    # Insert all rows in the same transaction
+    await db.execute(
+        insert(DBSensorData),
+        [item.model_dump() | {"id": str(ulid())} for item in data]
+    )
+    await db.commit()
+    
+    return {"message": "Data recorded successfully", "count": len(data)}
+
+
 @router.get("/data", response_model=List[SensorDataResponse])
 async def get_sensor_data(
     current_user: Annotated[DBUser, Depends(get_current_active_user)],
@@ -49,120 +118,218 @@ async def get_sensor_data(
     end_time: Optional[datetime] = Query(None, description="End time for data filter"),
     sensor_type: Optional[str] = Query(None, description="Type of sensor (temperature, humidity, voltage, current)"),
     aggregation: Optional[str] = Query(None, description="Aggregation level (minute, hour, day)"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Validate sensor_type
-    valid_sensor_types = ["temperature", "humidity", "voltage", "current"]
-    if sensor_type and sensor_type not in valid_sensor_types:
-        raise HTTPException(status_code=400, detail=f"Invalid sensor type. Must be one of {valid_sensor_types}")
+    if sensor_type and sensor_type not in SENSOR_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Invalid sensor type. Must be one of {list(SENSOR_COLUMNS)}")
     
     # Validate aggregation
-    valid_aggregations = ["minute", "hour", "day"]
-    if aggregation and aggregation not in valid_aggregations:
-        raise HTTPException(status_code=400, detail=f"Invalid aggregation. Must be one of {valid_aggregations}")
-    
-    # Build query based on user's servers
-    query = db.query(DBSensorData)
-    query = query.join(DBServer)
-    query = query.filter(DBServer.owner_id == current_user.id)
+    if aggregation and aggregation not in AGGREGATIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid aggregation. Must be one of {list(AGGREGATIONS)}")
     
-    # Apply filters
-    if server_ulid:
-        query = query.filter(DBSensorData.server_ulid == server_ulid)
+    start_time, end_time = naive_utc(start_time), naive_utc(end_time)
     
-    if start_time:
-        query = query.filter(DBSensorData.timestamp >= start_time)
+    # Values are passed as bind parameters; each statement uses the ones it needs
+    params = {
+        "owner_id": current_user.id,
+        "server_ulid": server_ulid,
+        "start_time": start_time,
+        "end_time": end_time,
+    }
     
-    if end_time:
-        query = query.filter(DBSensorData.timestamp <= end_time)
+    # Aggregations are served from the continuous aggregates when available
+    if aggregation and TIMESCALEDB_ENABLED:
+        return await _get_rollup_data(db, aggregation, sensor_type, params)
     
+    # Which filters apply; the values themselves are in params
+    shape = (bool(server_ulid), start_time is not None, end_time is not None)
+    if aggregation:
+        stmt = _aggregated_query(aggregation, sensor_type, *shape)
+        return ORJSONResponse(await _fetch_rows(db, stmt, params))
+    return await _get_raw_data(db, sensor_type, _sensor_data_filters(*shape, sensor_type), params)
+
+
+def _sensor_data_filters(by_server: bool, from_start: bool, to_end: bool, sensor_type: Optional[str]):
+    filters = []
+    if by_server:
+        filters.append(DBSensorData.server_ulid == bindparam("server_ulid"))
+    if from_start:
+        filters.append(DBSensorData.timestamp >= bindparam("start_time"))
+    if to_end:
+        filters.append(DBSensorData.timestamp <= bindparam("end_time"))
     # If sensor_type is specified, ensure it's not null in the database
     if sensor_type:
-        if sensor_type == "temperature":
-            query = query.filter(DBSensorData.temperature != None)
-        elif sensor_type == "humidity":
-            query = query.filter(DBSensorData.humidity != None)
-        elif sensor_type == "voltage":
-            query = query.filter(DBSensorData.voltage != None)
-        elif sensor_type == "current":
-            query = query.filter(DBSensorData.current != None)
-    
-    # Apply aggregation if needed
-    if aggregation:
-        if aggregation == "minute":
-            time_trunc = func.date_trunc('minute', DBSensorData.timestamp)
-        elif aggregation == "hour":
-            time_trunc = func.date_trunc('hour', DBSensorData.timestamp)
-        elif aggregation == "day":
-            time_trunc = func.date_trunc('day', DBSensorData.timestamp)
-        
-        # Build aggregation query with proper grouping
-        stmt = (
-            select([
-                time_trunc.label('timestamp'),
-                func.avg(DBSensorData.temperature).label('temperature') if not sensor_type or sensor_type == "temperature" else None,
-                func.avg(DBSensorData.humidity).label('humidity') if not sensor_type or sensor_type == "humidity" else None,
-                func.avg(DBSensorData.voltage).label('voltage') if not sensor_type or sensor_type == "voltage" else None,
-                func.avg(DBSensorData.current).label('current') if not sensor_type or sensor_type == "current" else None
-            ])
+        filters.append(SENSOR_COLUMNS[sensor_type].isnot(None))
+    return filters
+
+
+async def _get_raw_data(db: AsyncSession, sensor_type: Optional[str], filters: list, params: dict):
+    # Build query based on user's servers, selecting only the response columns
+    # (other sensors come back as NULL so every row keeps the same keys)
+    query = SENSOR_DATA_BY_OWNER
+    if sensor_type:
+        query = query.with_only_columns(
+            DBSensorData.timestamp,
+            *(
+                column if name == sensor_type else null().label(name)
+                for name, column in SENSOR_COLUMNS.items()
+            )
+        )
+    query = query.where(*filters).order_by(DBSensorData.timestamp)
+    
+    # Rows come straight from typed columns, so skip ORM hydration and Pydantic serialization
+    result = await db.execute(query, params)
+    return ORJSONResponse([row._asdict() for row in result])
+
+
+# Aggregation statements only depend on which filters are set, so each shape
+# is built once; the filters compare with bind parameters, not values
+@functools.cache
+def _aggregated_query(
+    aggregation: str,
+    sensor_type: Optional[str],
+    by_server: bool,
+    from_start: bool,
+    to_end: bool,
+):
+    time_trunc = AGGREGATIONS[aggregation]
+    filters = _sensor_data_filters(by_server, from_start, to_end, sensor_type)
+    
+    # Build aggregation query with proper grouping
+    return (
+        select(
+            time_trunc.label('timestamp'),
+            *(
+                func.avg(column).label(name) if not sensor_type or name == sensor_type else null().label(name)
+                for name, column in SENSOR_COLUMNS.items()
+            )
+        )
+        .select_from(DBSensorData)
+        .join(DBServer)
+        .where(DBServer.owner_id == bindparam("owner_id"), *filters)
+        .group_by(time_trunc)
+        .order_by(time_trunc)
+    )
+
+
+async def _get_rollup_data(db: AsyncSession, aggregation: str, sensor_type: Optional[str], params: dict):
+    start_time, end_time = params["start_time"], params["end_time"]
+    width = BUCKET_WIDTHS[aggregation]
+    
+    # The view only holds whole buckets. Buckets cut by start_time or end_time
+    # are summed from sensor_data instead, so only readings inside the range
+    # count, as on the date_trunc path. Whole buckets run from full_from up to
+    # (not including) full_to.
+    full_from = _bucket_start(start_time, width) if start_time else None
+    if full_from is not None and full_from < start_time:
+        full_from += width
+    full_to = _bucket_start(end_time, width) if end_time else None
+    
+    stmt = _rollup_query(
+        aggregation,
+        sensor_type,
+        bool(params["server_ulid"]),
+        full_from is not None,
+        full_from is not None and full_from > start_time,
+        full_to is not None,
+    )
+    return ORJSONResponse(await _fetch_rows(db, stmt, params | {"full_from": full_from, "full_to": full_to}))
+
+
+@functools.cache
+def _rollup_query(
+    aggregation: str,
+    sensor_type: Optional[str],
+    by_server: bool,
+    from_bucket: bool,
+    start_edge: bool,
+    to_bucket: bool,
+):
+    view = SENSOR_DATA_ROLLUPS[aggregation]
+    
+    owner_and_server = [DBServer.owner_id == bindparam("owner_id")]
+    if by_server:
+        owner_and_server.append(DBServer.server_ulid == bindparam("server_ulid"))
+    
+    rollup = (
+        select(
+            view.c.bucket,
+            *(view.c[f"{sensor}_{part}"] for sensor in SENSOR_COLUMNS for part in ("sum", "count"))
+        )
+        .join(DBServer, DBServer.server_ulid == view.c.server_ulid)
+        .where(*owner_and_server)
+    )
+    if from_bucket:
+        rollup = rollup.where(view.c.bucket >= bindparam("full_from"))
+    if to_bucket:
+        rollup = rollup.where(view.c.bucket < bindparam("full_to"))
+    
+    edges = []
+    if start_edge:
+        edges.append(DBSensorData.timestamp < bindparam("full_from"))
+    if to_bucket:
+        edges.append(DBSensorData.timestamp >= bindparam("full_to"))
+    
+    buckets = rollup
+    if edges:
+        time_trunc = AGGREGATIONS[aggregation]
+        partial = (
+            select(
+                time_trunc.label("bucket"),
+                *(
+                    aggregate(column).label(f"{sensor}_{part}")
+                    for sensor, column in SENSOR_COLUMNS.items()
+                    for part, aggregate in (("sum", func.sum), ("count", func.count))
+                )
+            )
             .select_from(DBSensorData)
             .join(DBServer)
-            .where(DBServer.owner_id == current_user.id)
+            .where(*owner_and_server, *_sensor_data_filters(False, from_bucket, to_bucket, None), or_(*edges))
+            .group_by(time_trunc)
+        )
+        buckets = union_all(rollup, partial)
+    buckets = buckets.subquery()
+    
+    # Buckets hold per-server sums/counts; combine them into one average per bucket
+    stmt = select(
+        buckets.c.bucket.label("timestamp"),
+        *(
+            (func.sum(buckets.c[f"{sensor}_sum"]) / func.nullif(func.sum(buckets.c[f"{sensor}_count"]), 0)).label(sensor)
+            if not sensor_type or sensor == sensor_type else null().label(sensor)
+            for sensor in SENSOR_COLUMNS
         )
-        
-        # Apply the same filters from above
-        if server_ulid:
-            stmt = stmt.where(DBSensorData.server_ulid == server_ulid)
-        if start_time:
-            stmt = stmt.where(DBSensorData.timestamp >= start_time)
-        if end_time:
-            stmt = stmt.where(DBSensorData.timestamp <= end_time)
-        if sensor_type:
-            if sensor_type == "temperature":
-                stmt = stmt.where(DBSensorData.temperature != None)
-            elif sensor_type == "humidity":
-                stmt = stmt.where(DBSensorData.humidity != None)
-            elif sensor_type == "voltage":
-                stmt = stmt.where(DBSensorData.voltage != None)
-            elif sensor_type == "current":
-                stmt = stmt.where(DBSensorData.current != None)
-        
-        # Group by the truncated time
-        stmt = stmt.group_by(time_trunc).order_by(time_trunc)
-        
-        # Execute the aggregation query
-        result = db.execute(stmt).all()
-        
-        # Convert result to Pydantic models
-        response_data = []
-        for row in result:
-            data_dict = {
-                "timestamp": row.timestamp,
-            }
-            
-            if not sensor_type or sensor_type == "temperature":
-                data_dict["temperature"] = row.temperature
-            if not sensor_type or sensor_type == "humidity":
-                data_dict["humidity"] = row.humidity
-            if not sensor_type or sensor_type == "voltage":
-                data_dict["voltage"] = row.voltage
-            if not sensor_type or sensor_type == "current":
-                data_dict["current"] = row.current
-                
-            response_data.append(SensorDataResponse(**data_dict))
-        
-        return response_data
-    
-    # If no aggregation, just return the filtered data
-    result = query.order_by(DBSensorData.timestamp).all()
-    
-    # If a specific sensor was requested, only include that field in the response
+    )
     if sensor_type:
-        response_data = []
-        for item in result:
-            data_dict = {"timestamp": item.timestamp}
-            data_dict[sensor_type] = getattr(item, sensor_type)
-            response_data.append(SensorDataResponse(**data_dict))
-        return response_data
-    
-    return result
+        stmt = stmt.having(func.sum(buckets.c[f"{sensor_type}_count"]) > 0)
+    
+    return stmt.group_by(buckets.c.bucket).order_by(buckets.c.bucket)
+
+
+async def _fetch_rows(db: AsyncSession, stmt, params: dict):
+    # On asyncpg, read-only aggregations run directly on the session's asyncpg
+    # connection, skipping SQLAlchemy's result processing. Other drivers
+    # (aiosqlite in the tests) go through the connection as usual.
+    conn = await db.connection()
+    if conn.dialect.driver != "asyncpg":
+        result = await conn.execute(stmt, params)
+        return [row._asdict() for row in result]
+    
+    compiled = _compile(stmt, conn.dialect)
+    values = compiled.construct_params(params)
+    raw = await conn.get_raw_connection()
+    records = await raw.driver_connection.fetch(
+        compiled.string, *(values[name] for name in compiled.positiontup)
+    )
+    return [dict(record) for record in records]
+
+
+# The statements passed in are the cached ones above, so this compiles each shape once
+@functools.cache
+def _compile(stmt, dialect):
+    return stmt.compile(dialect=dialect)
+
+
+def _bucket_start(value: datetime, width: timedelta):
+    # Same boundaries as date_trunc/time_bucket for minute, hour and day
+    return datetime.min + (value - datetime.min) // width * width
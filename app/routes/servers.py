@@ -1,8 +1,9 @@
 from typing import Annotated, List
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, case, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ulid import ulid
 from app.database import get_db
 from app.models.models import DBServer, DBUser
@@ -11,24 +12,38 @@ from app.security.auth import get_current_active_user
 
 router = APIRouter(tags=["servers"])
 
+# Server is considered offline if no data for 10 seconds
+SERVER_OFFLINE_AFTER = timedelta(seconds=10)
+
+# Statements reused across requests; values are passed as bind parameters
+SERVERS_BY_OWNER = select(
+    DBServer.server_ulid,
+    DBServer.server_name,
+    case((DBServer.last_seen >= func.now() - SERVER_OFFLINE_AFTER, "online"), else_="offline").label("status")
+).where(DBServer.owner_id == bindparam("owner_id"))
+SERVER_BY_OWNER_AND_ULID = SERVERS_BY_OWNER.where(DBServer.server_ulid == bindparam("server_ulid"))
+
 
 @router.post("/servers", response_model=ServerResponse)
 async def create_server(
     server: ServerCreate,
     current_user: Annotated[DBUser, Depends(get_current_active_user)],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    server_ulid = str(ulid())
-    db_server = DBServer(
-        server_ulid=server_ulid,
-        server_name=server.server_name,
-        owner_id=current_user.id,
-        last_seen=datetime.now()
+    # RETURNING gives back the stored row without a separate refresh query
+    result = await db.execute(
+        insert(DBServer)
+        .values(
+            server_ulid=str(ulid()),
+            server_name=server.server_name,
+            owner_id=current_user.id,
+            # Also covers databases whose last_seen has no DEFAULT yet
+            last_seen=func.now()
+        )
+        .returning(DBServer)
     )
-    
-    db.add(db_server)
-    db.commit()
-    db.refresh(db_server)
+    db_server = result.scalar_one()
+    await db.commit()
     
     return ServerResponse(
         server_ulid=db_server.server_ulid,
@@ -40,25 +55,13 @@ async def create_server(
 @router.get("/health/all", response_model=List[ServerResponse])
 async def get_all_servers_health(
     current_user: Annotated[DBUser, Depends(get_current_active_user)],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    servers = db.query(DBServer).filter(DBServer.owner_id == current_user.id).all()
-    
-    # Server is considered offline if no data for 10 seconds
-    time_threshold = datetime.now() - timedelta(seconds=10)
-    
-    result = []
-    for server in servers:
-        status = "online" if server.last_seen and server.last_seen >= time_threshold else "offline"
-        result.append(
-            ServerResponse(
-                server_ulid=server.server_ulid,
-                server_name=server.server_name,
-                status=status
-            )
-        )
-    
-    return result
+    result = await db.execute(
+        SERVERS_BY_OWNER,
+        {"owner_id": current_user.id}
+    )
+    return [ServerResponse.model_construct(**row) for row in result.mappings()]
 
 
 
@@ -66,26 +69,19 @@ async def get_all_servers_health(
 async def get_server_health(
     server_ulid: str,
     current_user: Annotated[DBUser, Depends(get_current_active_user)],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    server = db.query(DBServer).filter(
-        DBServer.server_ulid == server_ulid,
-        DBServer.owner_id == current_user.id
-    ).first()
+    result = await db.execute(
+        SERVER_BY_OWNER_AND_ULID,
+        {
+            "owner_id": current_user.id,
+            "server_ulid": server_ulid
+        }
+    )
+    server = result.mappings().one_or_none()
     
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
     
-    # Server is considered offline if no data for 10 seconds
-    status = "online"
-    time_threshold = datetime.now() - timedelta(seconds=10)
-    
-    if server.last_seen is None or server.last_seen < time_threshold:
-        status = "offline"
-    
-    return ServerResponse(
-        server_ulid=server.server_ulid,
-        server_name=server.server_name,
-        status=status
-    )
+    return ServerResponse.model_construct(**server)
 
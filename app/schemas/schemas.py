@@ -1,7 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List
 
-from pydantic import BaseModel, field_validator, Field, ValidationInfo
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # sensor_data.timestamp is a naive column holding UTC; asyncpg rejects
+    # offset-aware values for it instead of converting them
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 # Pydantic models
 class Token(BaseModel):
@@ -19,8 +27,7 @@ class User(BaseModel):
     full_name: Optional[str] = None
     disabled: Optional[bool] = None
     
-    class ConfigDict:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 
@@ -44,27 +51,26 @@ class ServerResponse(BaseModel):
     server_name: str
     status: str
     
-    class ConfigDict:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class SensorDataPost(BaseModel):
     server_ulid: str
     timestamp: datetime
-    temperature: Optional[float] =  Field(default = None, validate_default=True)
-    humidity: Optional[float] =  Field(default = None, validate_default=True)
-    voltage: Optional[float] =  Field(default = None, validate_default=True)
-    current: Optional[float] =  Field(default = None, validate_default=True)
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    voltage: Optional[float] = None
+    current: Optional[float] = None
     
     @field_validator('timestamp')
     def check_timestamp_format(cls, v):
         # Ensure timestamp is in ISO 8601 format
         if not isinstance(v, datetime):
             try:
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
+                v = datetime.fromisoformat(v.replace('Z', '+00:00'))
             except (ValueError, AttributeError):
                 raise ValueError('Timestamp must be in ISO 8601 format')
-        return v
+        return naive_utc(v)
     
     @field_validator('humidity')
     def check_humidity_range(cls, v):
@@ -78,11 +84,11 @@ class SensorDataPost(BaseModel):
             raise ValueError('This field is required')
         return v
     
-    @field_validator('temperature', 'humidity', 'voltage', 'current')
-    def check_at_least_one_sensor(cls, v, info: ValidationInfo) -> str:
-        if v is None and all(info.data.get(field) is None for field in ['temperature', 'humidity', 'voltage', 'current']):
+    @model_validator(mode='after')
+    def check_at_least_one_sensor(self):
+        if self.temperature is None and self.humidity is None and self.voltage is None and self.current is None:
             raise ValueError('At least one sensor value must be provided')
-        return v
+        return self
 
 
 class SensorDataResponse(BaseModel):
@@ -92,5 +98,4 @@ class SensorDataResponse(BaseModel):
     voltage: Optional[float] = None
     current: Optional[float] = None
     
-    class ConfigDict:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
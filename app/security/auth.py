@@ -1,23 +1,44 @@
 from datetime import datetime, timedelta, timezone
-from typing import Annotated
+from typing import Annotated, Optional
+import asyncio
+import hashlib
+import json
+import time
 from jwt.exceptions import PyJWTError
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import jwt
 
+from app.cache import redis_client
 from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from app.database import get_db
 from app.models.models import DBUser
 from app.schemas.schemas import TokenData
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id for new hashes; existing bcrypt hashes still verify
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Reused across requests; the username is passed as a bind parameter
+USER_BY_USERNAME = select(DBUser).where(DBUser.username == bindparam("username"))
+CREDENTIALS_BY_USERNAME = select(DBUser.username, DBUser.hashed_password).where(
+    DBUser.username == bindparam("username")
+)
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -27,13 +48,17 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(db: Session, username: str):
-    return db.query(DBUser).filter(DBUser.username == username).first()
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(USER_BY_USERNAME, {"username": username})
+    return result.scalar_one_or_none()
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    # Only the columns needed to check the password; returns a row, not a DBUser
+    result = await db.execute(CREDENTIALS_BY_USERNAME, {"username": username})
+    user = result.one_or_none()
+    # Hash verification is CPU-bound, keep it off the event loop
+    if not user or not await asyncio.to_thread(verify_password, password, user.hashed_password):
         return False
     return user
 
@@ -49,7 +74,42 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
+def _user_cache_key(token: str):
+    return "auth:" + hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+async def _get_cached_user(token: str):
+    if redis_client is None:
+        return None
+    try:
+        cached = await redis_client.get(_user_cache_key(token))
+    except RedisError:
+        return None
+    # Detached user without the password hash; only used to authorize the request
+    return DBUser(**json.loads(cached)) if cached else None
+
+
+async def _cache_user(token: str, user: DBUser, expires_at: Optional[int]):
+    # Tokens without an expiry have no lifetime to bound the entry, so they aren't cached
+    if redis_client is None or expires_at is None:
+        return
+    ttl = expires_at - int(time.time())
+    if ttl <= 0:
+        return
+    cached = {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "full_name": user.full_name,
+        "disabled": user.disabled,
+    }
+    try:
+        await redis_client.set(_user_cache_key(token), json.dumps(cached), ex=ttl)
+    except RedisError:
+        pass
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -64,9 +124,15 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
     except InvalidTokenError:
         raise credentials_exception
     
-    user = get_user(db, username=token_data.username)
+    # Cached for the remaining lifetime of the token
+    user = await _get_cached_user(token)
+    if user is not None:
+        return user
+    
+    user = await get_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    await _cache_user(token, user, payload.get("exp"))
     return user
 
 
@@ -0,0 +1,114 @@
+from sqlalchemy import text
+
+# Hypertables need the time column in every unique constraint. sensor_data
+# tables created before "timestamp" joined the primary key still have it on
+# id alone, and create_all doesn't alter existing tables.
+SENSOR_DATA_PRIMARY_KEY_UPGRADE = """
+    DO $$
+    DECLARE
+        pkey name;
+    BEGIN
+        SELECT conname INTO pkey FROM pg_constraint
+        WHERE conrelid = 'sensor_data'::regclass AND contype = 'p'
+            AND NOT (
+                SELECT attnum FROM pg_attribute
+                WHERE attrelid = 'sensor_data'::regclass AND attname = 'timestamp'
+            ) = ANY (conkey);
+        IF pkey IS NOT NULL THEN
+            EXECUTE format(
+                'ALTER TABLE sensor_data DROP CONSTRAINT %I, ADD PRIMARY KEY (id, "timestamp")', pkey
+            );
+        END IF;
+    END
+    $$
+"""
+
+# TimescaleDB setup, applied after the tables exist. Every statement is
+# idempotent so it is safe to run on each startup.
+HYPERTABLE_DDL = [
+    SENSOR_DATA_PRIMARY_KEY_UPGRADE,
+    "CREATE EXTENSION IF NOT EXISTS timescaledb",
+    # sensor_data already declares its own index on timestamp
+    """
+    SELECT create_hypertable(
+        'sensor_data', 'timestamp',
+        chunk_time_interval => INTERVAL '1 day',
+        create_default_indexes => false,
+        migrate_data => true,
+        if_not_exists => true
+    )
+    """,
+    # Compression settings can't be changed once chunks are compressed
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM timescaledb_information.hypertables
+            WHERE hypertable_name = 'sensor_data' AND compression_enabled
+        ) THEN
+            ALTER TABLE sensor_data SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'server_ulid',
+                timescaledb.compress_orderby = 'timestamp DESC'
+            );
+        END IF;
+    END
+    $$
+    """,
+    "SELECT add_compression_policy('sensor_data', INTERVAL '7 days', if_not_exists => true)",
+]
+
+# Continuous aggregates backing GET /data?aggregation=... as
+# (view, bucket width, refresh start_offset, end_offset, schedule_interval).
+# They keep per-server sums and counts rather than averages so the handler
+# can combine several servers into one exact average per bucket.
+# Refreshes only recompute buckets whose rows changed, so the windows are wide
+# enough to pick up late uploads (e.g. /data/bulk backfills). Readings older
+# than start_offset are left out until refreshed by hand (see README).
+CONTINUOUS_AGGREGATES = [
+    ("sensor_data_1m", "1 minute", "7 days", "1 minute", "1 minute"),
+    ("sensor_data_1h", "1 hour", "30 days", "1 hour", "30 minutes"),
+    ("sensor_data_1d", "1 day", "365 days", "1 day", "1 hour"),
+]
+
+# materialized_only = false lets queries see rows newer than the last refresh
+CONTINUOUS_AGGREGATE_DDL = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+    WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+    SELECT
+        time_bucket(INTERVAL '{bucket}', "timestamp") AS bucket,
+        server_ulid,
+        sum(temperature) AS temperature_sum, count(temperature) AS temperature_count,
+        sum(humidity) AS humidity_sum, count(humidity) AS humidity_count,
+        sum(voltage) AS voltage_sum, count(voltage) AS voltage_count,
+        sum(current) AS current_sum, count(current) AS current_count
+    FROM sensor_data
+    GROUP BY bucket, server_ulid
+    WITH NO DATA
+"""
+
+# Replaced on every startup so changes to the windows above reach existing databases
+CONTINUOUS_AGGREGATE_POLICY = [
+    "SELECT remove_continuous_aggregate_policy('{view}', if_exists => true)",
+    """
+    SELECT add_continuous_aggregate_policy(
+        '{view}',
+        start_offset => INTERVAL '{start_offset}',
+        end_offset => INTERVAL '{end_offset}',
+        schedule_interval => INTERVAL '{schedule}',
+        if_not_exists => true
+    )
+    """,
+]
+
+
+async def setup_timescale(conn):
+    for statement in HYPERTABLE_DDL:
+        await conn.execute(text(statement))
+
+    for view, bucket, start_offset, end_offset, schedule in CONTINUOUS_AGGREGATES:
+        await conn.execute(text(CONTINUOUS_AGGREGATE_DDL.format(view=view, bucket=bucket)))
+        for statement in CONTINUOUS_AGGREGATE_POLICY:
+            await conn.execute(text(statement.format(
+                view=view, start_offset=start_offset, end_offset=end_offset, schedule=schedule
+            )))
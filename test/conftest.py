@@ -0,0 +1,137 @@
+import hashlib
+import os
+import uuid
+
+import pytest
+from passlib.context import CryptContext
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# Tests run against in-memory SQLite unless DATABASE_URL points elsewhere.
+# Tests marked `postgres` need a Postgres DATABASE_URL and are skipped otherwise.
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+# Kept in the environment because xdist workers inherit it after the main
+# process has rewritten DATABASE_URL below
+BASE_DATABASE_URL = os.environ.setdefault("BASE_DATABASE_URL", os.environ["DATABASE_URL"])
+POSTGRES = make_url(BASE_DATABASE_URL).get_backend_name() == "postgresql"
+
+# The tests share the app's engine; a smaller pool is enough for them, and
+# connections to a local database don't need pinging before use
+os.environ.setdefault("DB_POOL_SIZE", "10")
+os.environ.setdefault("DB_MAX_OVERFLOW", "20")
+os.environ.setdefault("DB_POOL_PRE_PING", "false")
+
+# With Postgres every test process (each pytest-xdist worker included) gets its
+# own database, e.g. dtlabs_test_3f9c0a1b2d4e or dtlabs_test_gw0_3f9c0a1b2d4e,
+# so runs sharing a server never touch each other's. DATABASE_URL is rewritten
+# before the app is imported so its engine uses it too.
+XDIST_WORKER = os.getenv("PYTEST_XDIST_WORKER")
+if POSTGRES:
+    _url = make_url(BASE_DATABASE_URL)
+    _run = uuid.uuid4().hex[:12]
+    _suffix = f"test_{XDIST_WORKER}_{_run}" if XDIST_WORKER else f"test_{_run}"
+    os.environ["DATABASE_URL"] = _url.set(
+        database=f"{_url.database}_{_suffix}"
+    ).render_as_string(hide_password=False)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: test relies on Postgres-only SQL")
+
+
+def pytest_collection_modifyitems(config, items):
+    if POSTGRES:
+        return
+    skip_postgres = pytest.mark.skip(reason="needs a Postgres DATABASE_URL")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip_postgres)
+
+
+# Set TEST_FAST_HASH=0 to run the tests with the production hash settings
+TEST_FAST_HASH = os.getenv("TEST_FAST_HASH", "1") == "1"
+
+
+# Password hashing is deliberately slow; the tests only need it to round-trip
+@pytest.fixture(scope="session", autouse=True)
+def fast_password_hash():
+    if not TEST_FAST_HASH:
+        yield
+        return
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(
+            "app.security.auth.pwd_context",
+            CryptContext(
+                schemes=["argon2"],
+                argon2__type="ID",
+                argon2__memory_cost=8,
+                argon2__time_cost=1,
+                argon2__parallelism=1,
+            )
+        )
+        yield
+
+
+def _schema_hash(metadata, dialect):
+    ddl = [str(CreateTable(table).compile(dialect=dialect)) for table in metadata.sorted_tables]
+    ddl += [
+        str(CreateIndex(index).compile(dialect=dialect))
+        for table in metadata.sorted_tables
+        for index in sorted(table.indexes, key=lambda index: index.name)
+    ]
+    return hashlib.sha256("".join(ddl).encode()).hexdigest()[:12]
+
+
+# Copy the test database from a template that already holds the schema. The
+# template is named after the schema, so it is only built again when the
+# models change, and the template for the previous schema is dropped then.
+# Databases are managed through a maintenance connection to the main one.
+@pytest.fixture(scope="session")
+def test_database():
+    if not POSTGRES:
+        yield
+        return
+
+    from app.models.models import Base
+
+    url = make_url(BASE_DATABASE_URL)
+    name = make_url(os.environ["DATABASE_URL"]).database
+    maintenance = create_engine(url, isolation_level="AUTOCOMMIT")
+    prefix = f"{url.database}_template_"
+    template = f"{prefix}{_schema_hash(Base.metadata, maintenance.dialect)}"
+
+    with maintenance.connect() as conn:
+        # One lock for all templates, so no run drops a template while another
+        # builds or copies one
+        conn.execute(text("SELECT pg_advisory_lock(hashtext(:name))"), {"name": prefix})
+        try:
+            databases = conn.execute(text("SELECT datname FROM pg_database")).scalars().all()
+            if template not in databases:
+                for stale in databases:
+                    if stale.startswith(prefix):
+                        conn.execute(text(f'DROP DATABASE "{stale}" WITH (FORCE)'))
+                _create_template(conn, url.set(database=template), Base.metadata)
+            conn.execute(text(f'CREATE DATABASE "{name}" TEMPLATE "{template}"'))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": prefix})
+
+    yield
+
+    with maintenance.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    maintenance.dispose()
+
+
+def _create_template(conn, url, metadata):
+    conn.execute(text(f'CREATE DATABASE "{url.database}"'))
+    template_engine = create_engine(url)
+    try:
+        metadata.create_all(template_engine)
+    except Exception:
+        template_engine.dispose()
+        conn.execute(text(f'DROP DATABASE "{url.database}" WITH (FORCE)'))
+        raise
+    # Nobody may be connected to a template while it is copied
+    template_engine.dispose()
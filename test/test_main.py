@@ -1,93 +1,247 @@
+import asyncio
+import json
+import httpx
+import jwt
 import pytest
-import time
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime, timedelta
-import os
+from redis.exceptions import RedisError
+from sqlalchemy import delete, event, func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
 from app.main import app, Base
-from app.database import get_db
+from app.config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
+from app.database import SCHEMA_UPGRADES, engine, get_db
 from app.security.auth import get_password_hash 
-from app.models.models import DBUser, DBServer
+from app.models.models import DBUser, DBServer, DBSensorData, SENSOR_DATA_ROLLUPS
+from app.timescale import SENSOR_DATA_PRIMARY_KEY_UPGRADE, setup_timescale
 import uuid
 
-# Test database
+# Test database: the app's own engine, so an in-memory SQLite database is shared
+# with the app (DATABASE_URL is set up in conftest.py)
 
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+# Fixed reading timestamps, so payloads are the same on every run; the seeded
+# reading sits at NOW_ISO, inside START_ISO..END_ISO
+NOW = datetime(2025, 1, 1)
+NOW_ISO = NOW.isoformat()
+START_ISO = (NOW - timedelta(hours=1)).isoformat()
+END_ISO = (NOW + timedelta(hours=1)).isoformat()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Request bodies shared by several tests
+LOGIN_FORM = {"username": "testuser", "password": "testpassword"}
+READING = {
+    "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
+    "timestamp": NOW_ISO,
+    "temperature": 25.5
+}
 
+# Children before parents, so rows can be removed in this order
+TABLES = list(reversed(Base.metadata.sorted_tables))
 
-# Fixture to create/drop test database before/after tests
-@pytest.fixture(scope="function")
-def test_db():
-    # Create tables
-    Base.metadata.create_all(bind=engine)
-    
-    # Add test data
-    db = TestingSessionLocal()
-    test_user = DBUser(
-        id="01HQNJ3P8TMRZ5QPBHF3GPTVWH",
-        username="testuser",
-        email="test@example.com",
-        full_name="Test User",
-        hashed_password=get_password_hash("testpassword"),
-        disabled=False
-    )
+
+async def clear_tables(conn, tables):
+    # TRUNCATE skips DELETE's per-row work and the DDL of drop_all/create_all;
+    # SQLite has no TRUNCATE
+    if conn.dialect.name == "postgresql":
+        names = ", ".join(table.name for table in tables)
+        await conn.execute(text(f"TRUNCATE TABLE {names} RESTART IDENTITY CASCADE"))
+    else:
+        for table in tables:
+            await conn.execute(delete(table))
+
+
+# Session of the running test, handed to the app in place of get_db
+current_session = None
+
+
+async def override_get_db():
+    if current_session is None:
+        # Session-scoped fixtures run outside any test; use a regular session
+        async for db in get_db():
+            yield db
+    else:
+        yield current_session
+
+
+# Client for making test requests, started once so the app's lifespan runs once.
+# Server errors come back as 500 responses for the assertions to report.
+@pytest.fixture(scope="session")
+def client(test_database):
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.pop(get_db, None)
+
+
+# Fixture to create the schema and seed data once, and clear the tables after the test session
+@pytest.fixture(scope="session")
+def test_db(client):
+    async def create():
+        async with engine.begin() as conn:
+            # Create tables
+            await conn.run_sync(Base.metadata.create_all)
+            
+            # Add test data, one INSERT per table
+            await conn.execute(
+                insert(DBUser),
+                [{
+                    "id": "01HQNJ3P8TMRZ5QPBHF3GPTVWH",
+                    "username": "testuser",
+                    "email": "test@example.com",
+                    "full_name": "Test User",
+                    "hashed_password": get_password_hash("testpassword"),
+                    "disabled": False
+                }]
+            )
+            await conn.execute(
+                insert(DBServer),
+                [
+                    {
+                        "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
+                        "server_name": "Test Server",
+                        "owner_id": "01HQNJ3P8TMRZ5QPBHF3GPTVWH",
+                        "last_seen": datetime.now(timezone.utc)
+                    },
+                    {
+                        "server_ulid": "01HQNJ5WF7Q24KPJDVA0SXMHBR",
+                        "server_name": "Offline Server",
+                        "owner_id": "01HQNJ3P8TMRZ5QPBHF3GPTVWH",
+                        "last_seen": datetime.now(timezone.utc) - timedelta(seconds=15)
+                    }
+                ]
+            )
+    
+    async def clear():
+        async with engine.begin() as conn:
+            await clear_tables(conn, TABLES)
+    
+    # Database connections belong to the client's event loop
+    client.portal.call(create)
     
-    test_server = DBServer(
-        server_ulid="01HQNJ4RT8Z6MSPMTC83WTPQTA",
-        server_name="Test Server",
-        owner_id="01HQNJ3P8TMRZ5QPBHF3GPTVWH",
-        last_seen=datetime.now()
-    )
+    yield
     
-    offline_server = DBServer(
-        server_ulid="01HQNJ5WF7Q24KPJDVA0SXMHBR",
-        server_name="Offline Server",
-        owner_id="01HQNJ3P8TMRZ5QPBHF3GPTVWH",
-        last_seen=datetime.now() - timedelta(seconds=15)
-    )
+    # Clean up, leaving the schema for the next run
+    client.portal.call(clear)
+
+
+# Every test runs inside a transaction that is rolled back afterwards; the app's
+# commits only release SAVEPOINTs inside it
+@pytest.fixture(scope="function", autouse=True)
+def db_session(client, test_db):
+    global current_session
     
-    db.add(test_user)
-    db.add(test_server)
-    db.add(offline_server)
-    db.commit()
+    async def begin():
+        conn = await engine.connect()
+        transaction = await conn.begin()
+        session = AsyncSession(bind=conn, expire_on_commit=False, join_transaction_mode="create_savepoint")
+        return conn, transaction, session
     
-    # Override dependency
-    def override_get_db():
-        try:
-            db = TestingSessionLocal()
-            yield db
-        finally:
-            db.close()
+    async def rollback():
+        await session.close()
+        await transaction.rollback()
+        await conn.close()
     
-    app.dependency_overrides[get_db] = override_get_db
+    conn, transaction, session = client.portal.call(begin)
+    current_session = session
     
+    yield session
+    
+    current_session = None
+    client.portal.call(rollback)
+
+
+# Let the app open its own sessions, for tests whose requests run concurrently
+# and so can't share the test's session; they only see committed data
+@pytest.fixture(scope="function")
+def app_sessions(db_session):
+    global current_session
+    current_session = None
     yield
+    current_session = db_session
+
+
+# Set up TimescaleDB in the test database once, if the server has it preloaded.
+# It runs in one committed transaction, as in init_db, outside the tests'
+# rolled-back sessions so every test sees the hypertable and the aggregates.
+@pytest.fixture(scope="session")
+def timescale(client, test_db):
+    async def setup():
+        async with engine.begin() as conn:
+            available = (await conn.execute(text(
+                "SELECT current_setting('shared_preload_libraries') LIKE '%timescaledb%'"
+            ))).scalar()
+            if available:
+                await setup_timescale(conn)
+            return available
     
-    # Clean up
-    db.close()
-    Base.metadata.drop_all(bind=engine)
+    return client.portal.call(setup)
 
 
-# Client for making test requests
+# Serve aggregations from the rollups; without TimescaleDB plain views with the
+# same columns stand in for the continuous aggregates
 @pytest.fixture(scope="function")
-def client(test_db):
-    with TestClient(app) as c:
-        yield c
+def sensor_data_rollups(client, db_session, timescale, monkeypatch):
+    monkeypatch.setattr("app.routes.sensor_data.TIMESCALEDB_ENABLED", True)
+    if timescale:
+        return
+    
+    sums_and_counts = ", ".join(
+        f"sum({sensor}) AS {sensor}_sum, count({sensor}) AS {sensor}_count"
+        for sensor in ("temperature", "humidity", "voltage", "current")
+    )
+    
+    async def create_views():
+        for unit, view in SENSOR_DATA_ROLLUPS.items():
+            await db_session.execute(text(
+                f"CREATE VIEW {view.name} AS "
+                f"SELECT date_trunc('{unit}', \"timestamp\") AS bucket, server_ulid, {sums_and_counts} "
+                f"FROM sensor_data GROUP BY bucket, server_ulid"
+            ))
+    
+    client.portal.call(create_views)
 
 
-# Helper function to get auth token
-def get_auth_token(client):
+# Log in once and share the token across tests
+@pytest.fixture(scope="session")
+def auth_token(client, test_db):
     response = client.post(
         "/auth/login",
-        data={"username": "testuser", "password": "testpassword"}
+        data=LOGIN_FORM
     )
     return response.json()["access_token"]
 
 
+# Read-only, since every test shares it
+@pytest.fixture(scope="session")
+def auth_headers(auth_token):
+    return MappingProxyType({"Authorization": f"Bearer {auth_token}"})
+
+
+# One reading with every sensor, committed once for the GET tests and deleted afterwards
+@pytest.fixture(scope="module")
+def seed_sensor_data(client, test_db):
+    response = client.post(
+        "/data",
+        json={
+            "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
+            "timestamp": NOW_ISO,
+            "temperature": 25.5,
+            "humidity": 60.0,
+            "voltage": 220.0,
+            "current": 1.5
+        }
+    )
+    assert response.status_code == 201
+    
+    yield
+    
+    async def delete_readings():
+        async with engine.begin() as conn:
+            await clear_tables(conn, [DBSensorData.__table__])
+    
+    client.portal.call(delete_readings)
+
+
 # Test authentication failure
 def test_authentication_required(client):
     response = client.get("/data")  # Tentativa sem token
@@ -111,11 +265,25 @@ def test_register_user(client):
     assert data["full_name"] == "New User"
 
 
+# Test that every registered user gets its own id
+def test_register_multiple_users(client):
+    for username in ["firstuser", "seconduser"]:
+        response = client.post(
+            "/auth/register",
+            json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": "password"
+            }
+        )
+        assert response.status_code == 200
+
+
 # Test user login
 def test_login(client):
     response = client.post(
         "/auth/login",
-        data={"username": "testuser", "password": "testpassword"}
+        data=LOGIN_FORM
     )
     assert response.status_code == 200
     data = response.json()
@@ -123,17 +291,101 @@ def test_login(client):
     assert data["token_type"] == "bearer"
 
 
-# Test create server
-def test_create_server(client):
-    token = get_auth_token(client)
+# In-memory stand-in for the Redis client used by the auth user cache
+class FakeRedis:
+    def __init__(self, fail=False):
+        self.values = {}
+        self.ttls = {}
+        self.fail = fail
+    
+    async def get(self, key):
+        if self.fail:
+            raise RedisError("unavailable")
+        return self.values.get(key)
+    
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise RedisError("unavailable")
+        self.values[key] = value.encode()
+        self.ttls[key] = ex
+
+
+@pytest.fixture(scope="function")
+def users_queries():
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" in statement:
+            statements.append(statement)
+    
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+# Test the cached user serves later requests without querying users
+def test_cached_user_skips_users_query(client, auth_headers, users_queries, monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr("app.security.auth.redis_client", redis)
+    
+    assert client.get("/data", headers=auth_headers).status_code == 200
+    assert len(users_queries) == 1
+    [ttl] = redis.ttls.values()
+    assert 0 < ttl <= ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    
+    assert client.get("/data", headers=auth_headers).status_code == 200
+    assert len(users_queries) == 1
+
+
+# Test a cached user is still checked for being disabled
+def test_cached_disabled_user_rejected(client, auth_headers, monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr("app.security.auth.redis_client", redis)
+    assert client.get("/data", headers=auth_headers).status_code == 200
+    
+    [key] = redis.values
+    redis.values[key] = json.dumps({**json.loads(redis.values[key]), "disabled": True}).encode()
+    
+    response = client.get("/data", headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Inactive user"
+
+
+# Test requests fall back to the database when Redis fails
+def test_redis_error_falls_back_to_database(client, auth_headers, users_queries, monkeypatch):
+    monkeypatch.setattr("app.security.auth.redis_client", FakeRedis(fail=True))
+    
+    for _ in range(2):
+        assert client.get("/data", headers=auth_headers).status_code == 200
+    assert len(users_queries) == 2
+
+
+# Test a signed token without an expiry is accepted but not cached
+def test_token_without_expiry_not_cached(client, test_db, users_queries, monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr("app.security.auth.redis_client", redis)
+    token = jwt.encode({"sub": LOGIN_FORM["username"]}, SECRET_KEY, algorithm=ALGORITHM)
+    
+    response = client.get("/data", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert len(users_queries) == 1
+    assert redis.values == {}
+
+
+# Test create server; ids keep the uuid case's name stable for xdist
+@pytest.mark.parametrize("server_name", [
+    pytest.param("New Server", id="name"),
+    pytest.param(f"Server {uuid.uuid4()}", id="unique-name")
+])
+def test_create_server(client, auth_headers, server_name):
     response = client.post(
         "/servers",
-        json={"server_name": "New Server"},
-        headers={"Authorization": f"Bearer {token}"}
+        json={"server_name": server_name},
+        headers=auth_headers
     )
     assert response.status_code == 200
     data = response.json()
-    assert data["server_name"] == "New Server"
+    assert data["server_name"] == server_name
     assert "server_ulid" in data
     assert data["status"] == "online"
 
@@ -144,7 +396,7 @@ def test_post_sensor_data(client):
         "/data",
         json={
             "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": NOW_ISO,
             "temperature": 25.5,
             "humidity": 60.0
         }
@@ -153,16 +405,25 @@ def test_post_sensor_data(client):
     assert response.json()["message"] == "Data recorded successfully"
 
 
-# Test post sensor data - server not found
-def test_post_sensor_data_server_not_found(client):
+# Test post sensor data - only the last sensor field set
+def test_post_sensor_data_single_sensor(client):
     response = client.post(
         "/data",
         json={
-            "server_ulid": "NONEXISTENT",
-            "timestamp": datetime.now().isoformat(),
-            "temperature": 25.5
+            "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
+            "timestamp": NOW_ISO,
+            "current": 1.5
         }
     )
+    assert response.status_code == 201
+
+
+# Test post sensor data - server not found
+def test_post_sensor_data_server_not_found(client):
+    response = client.post(
+        "/data",
+        json={**READING, "server_ulid": "NONEXISTENT"}
+    )
     assert response.status_code == 404
     assert "Server not found" in response.json()["detail"]
 
@@ -173,30 +434,66 @@ def test_post_sensor_data_no_sensors(client):
         "/data",
         json={
             "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": NOW_ISO
         }
     )
     assert response.status_code == 422
 
 
-# Test get sensor data
-def test_get_sensor_data(client):
-    # First post some data
-    client.post(
-        "/data",
-        json={
-            "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
-            "timestamp": datetime.now().isoformat(),
-            "temperature": 25.5,
-            "humidity": 60.0
-        }
+# Test post sensor data in bulk
+def test_post_sensor_data_bulk(client):
+    response = client.post(
+        "/data/bulk",
+        json=[
+            READING,
+            {
+                "server_ulid": "01HQNJ5WF7Q24KPJDVA0SXMHBR",
+                "timestamp": NOW_ISO,
+                "temperature": 24.0,
+                "voltage": 220.0
+            }
+        ]
+    )
+    assert response.status_code == 201
+    assert response.json()["count"] == 2
+
+
+# Test post sensor data in bulk - server not found
+def test_post_sensor_data_bulk_server_not_found(client):
+    response = client.post(
+        "/data/bulk",
+        json=[
+            READING,
+            {**READING, "server_ulid": "NONEXISTENT"}
+        ]
     )
+    assert response.status_code == 404
+    assert "NONEXISTENT" in response.json()["detail"]
+
+
+# Test timestamps with a UTC offset are stored and filtered as UTC
+def test_sensor_data_with_utc_offset(client, auth_headers):
+    response = client.post("/data", json={**READING, "timestamp": "2025-01-02T03:00:00Z"})
+    assert response.status_code == 201
+    
+    response = client.post("/data/bulk", json=[{**READING, "timestamp": "2025-01-02T05:00:00+02:00"}])
+    assert response.status_code == 201
     
+    response = client.get(
+        "/data",
+        params={"start_time": "2025-01-02T02:00:00+00:00", "end_time": "2025-01-02T04:00:00Z"},
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert [row["timestamp"] for row in response.json()] == ["2025-01-02T03:00:00"] * 2
+
+
+# Test get sensor data
+def test_get_sensor_data(client, auth_headers, seed_sensor_data):
     # Get the data
-    token = get_auth_token(client)
     response = client.get(
         "/data",
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     
     assert response.status_code == 200
@@ -220,11 +517,17 @@ def test_invalid_timestamp_format(client):
 
 
 # Test all servers health endpoint
-def test_all_servers_health(client):
-    token = get_auth_token(client)
+@pytest.mark.postgres
+def test_all_servers_health(client, auth_headers):
+    
+    # The seeded online server may have aged past the threshold earlier in the session
+    client.post(
+        "/data",
+        json=READING
+    )
     response = client.get(
         "/health/all", 
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     assert response.status_code == 200
     data = response.json()
@@ -236,14 +539,14 @@ def test_all_servers_health(client):
     assert "online" in statuses
     assert "offline" in statuses
     
-def test_server_health(client):
-    token = get_auth_token(client)
+@pytest.mark.postgres
+def test_server_health(client, auth_headers, db_session):
     
     # Test online server
     response = client.post(
         "/servers",
         json={"server_name": "Test Server"},
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     assert response.status_code == 200
     server_ulid = response.json()["server_ulid"]
@@ -251,18 +554,33 @@ def test_server_health(client):
     # Verificando o status do servidor logo após a criação
     response = client.get(
         f"/health/{server_ulid}",
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     assert response.status_code == 200
     data = response.json()
     assert data["status"] == "online"
     
-    time.sleep(10)
+    # Age the server past the offline window instead of waiting for it
+    async def age_server():
+        await db_session.execute(
+            update(DBServer)
+            .where(DBServer.server_ulid == server_ulid)
+            .values(last_seen=func.now() - timedelta(seconds=30))
+        )
+    
+    client.portal.call(age_server)
     
-    # Test offline server (simulate offline by changing last_seen in the DB or waiting)
+    response = client.get(
+        f"/health/{server_ulid}",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "offline"
+    
+    # Test offline server seeded with an old last_seen
     response = client.get(
         "/health/01HQNJ5WF7Q24KPJDVA0SXMHBR",  # Use a known offline server id
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     assert response.status_code == 200
     data = response.json()
@@ -270,27 +588,14 @@ def test_server_health(client):
 
 
 # Test GET /data with server_ulid filter
-def test_get_sensor_data_by_server(client):
-    token = get_auth_token(client)
+def test_get_sensor_data_by_server(client, auth_headers, seed_sensor_data):
     
-    # First post some test data for different servers
     server_id = "01HQNJ4RT8Z6MSPMTC83WTPQTA"
     
-    # Post data for the first server
-    client.post(
-        "/data",
-        json={
-            "server_ulid": server_id,
-            "timestamp": datetime.now().isoformat(),
-            "temperature": 25.5,
-            "humidity": 60.0
-        }
-    )
-    
     # Get the data filtered by server_ulid
     response = client.get(
         f"/data?server_ulid={server_id}",
-        headers={"Authorization": f"Bearer {token}"}
+        headers=auth_headers
     )
     
     assert response.status_code == 200
@@ -301,92 +606,66 @@ def test_get_sensor_data_by_server(client):
 
 
 # Test GET /data with time range filter
-def test_get_sensor_data_by_time_range(client):
-    token = get_auth_token(client)
-    
-    # Create timestamps for our test
-    now = datetime.now()
-    start_time = (now - timedelta(hours=1)).isoformat()
-    mid_time = now.isoformat()
-    end_time = (now + timedelta(hours=1)).isoformat()
-    
-    # Post data with timestamp in the middle of our range
-    client.post(
-        "/data",
-        json={
-            "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
-            "timestamp": mid_time,
-            "temperature": 25.5
-        }
-    )
+def test_get_sensor_data_by_time_range(client, auth_headers, seed_sensor_data):
     
     # Get data within time range
     response = client.get(
-        f"/data?start_time={start_time}&end_time={end_time}",
-        headers={"Authorization": f"Bearer {token}"}
+        f"/data?start_time={START_ISO}&end_time={END_ISO}",
+        headers=auth_headers
     )
     
     assert response.status_code == 200
     data = response.json()
     assert isinstance(data, list)
+    assert [row["timestamp"] for row in data] == [NOW_ISO]
 
 
 # Test GET /data with sensor_type filter
-def test_get_sensor_data_by_sensor_type(client):
-    token = get_auth_token(client)
-    
-    # Post data with multiple sensor types
-    client.post(
-        "/data",
-        json={
-            "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
-            "timestamp": datetime.now().isoformat(),
-            "temperature": 25.5,
-            "humidity": 60.0,
-            "voltage": 220.0,
-            "current": 1.5
-        }
+@pytest.mark.parametrize("sensor_type", ["temperature", "humidity", "voltage", "current"])
+def test_get_sensor_data_by_sensor_type(client, auth_headers, seed_sensor_data, sensor_type):
+    response = client.get(
+        f"/data?sensor_type={sensor_type}",
+        headers=auth_headers
     )
     
-    # Test each sensor type individually
+    assert response.status_code == 200
+    data = response.json()
+    assert isinstance(data, list)
+
+
+# Test GET /data with every sensor_type at once; in-memory SQLite has a single
+# connection, so concurrent sessions need Postgres
+@pytest.mark.postgres
+def test_get_sensor_data_by_sensor_type_concurrently(client, auth_headers, seed_sensor_data, app_sessions):
     sensor_types = ["temperature", "humidity", "voltage", "current"]
     
-    for sensor in sensor_types:
-        response = client.get(
-            f"/data?sensor_type={sensor}",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        
+    async def get_all():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+            return await asyncio.gather(*(
+                ac.get("/data", params={"sensor_type": sensor}, headers=auth_headers)
+                for sensor in sensor_types
+            ))
+    
+    # Run on the client's event loop, which owns the app's database connections
+    responses = client.portal.call(get_all)
+    
+    for sensor, response in zip(sensor_types, responses):
         assert response.status_code == 200
         data = response.json()
-        assert isinstance(data, list)
+        assert len(data) == 1
+        assert data[0][sensor] is not None
 
 
 # Test combining multiple filters
-def test_get_sensor_data_with_combined_filters(client):
-    token = get_auth_token(client)
+def test_get_sensor_data_with_combined_filters(client, auth_headers, seed_sensor_data):
     
-    # Use a specific server and time range
+    # Use a specific server and the time range around the seeded reading
     server_id = "01HQNJ4RT8Z6MSPMTC83WTPQTA"
-    now = datetime.now()
-    start_time = (now - timedelta(hours=1)).isoformat()
-    end_time = (now + timedelta(hours=1)).isoformat()
-    
-    # Post test data
-    client.post(
-        "/data",
-        json={
-            "server_ulid": server_id,
-            "timestamp": now.isoformat(),
-            "temperature": 25.5,
-            "humidity": 60.0
-        }
-    )
     
     # Get data with combined filters
     response = client.get(
-        f"/data?server_ulid={server_id}&start_time={start_time}&end_time={end_time}&sensor_type=temperature",
-        headers={"Authorization": f"Bearer {token}"}
+        f"/data?server_ulid={server_id}&start_time={START_ISO}&end_time={END_ISO}&sensor_type=temperature",
+        headers=auth_headers
     )
     
     assert response.status_code == 200
@@ -394,42 +673,162 @@ def test_get_sensor_data_with_combined_filters(client):
     assert isinstance(data, list)
 
 
-# Test invalid parameters
-def test_get_sensor_data_with_invalid_parameters(client):
-    token = get_auth_token(client)
+# Test GET /data with aggregation
+@pytest.mark.postgres
+def test_get_sensor_data_aggregated(client, auth_headers):
+    
+    # Two readings in the same minute
+    for timestamp, temperature in [("2025-01-01T12:00:10", 20.0), ("2025-01-01T12:00:40", 30.0)]:
+        client.post(
+            "/data",
+            json={
+                "server_ulid": "01HQNJ4RT8Z6MSPMTC83WTPQTA",
+                "timestamp": timestamp,
+                "temperature": temperature
+            }
+        )
     
-    # Test invalid aggregation parameter
+    # Limited to that hour, other tests may have seeded readings
     response = client.get(
-        "/data?aggregation=invalid",
-        headers={"Authorization": f"Bearer {token}"}
+        "/data",
+        params={
+            "aggregation": "minute",
+            "sensor_type": "temperature",
+            "start_time": "2025-01-01T12:00:00Z",
+            "end_time": "2025-01-01T13:00:00+00:00"
+        },
+        headers=auth_headers
     )
-    assert response.status_code in [400, 422]
     
-    # Test invalid date format
-    response = client.get(
-        "/data?start_time=invalid-date",
-        headers={"Authorization": f"Bearer {token}"}
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["timestamp"] == "2025-01-01T12:00:00"
+    assert data[0]["temperature"] == 25.0
+    assert data[0]["humidity"] is None
+
+
+# Test aggregation from the rollups only counts readings inside the time range,
+# also in the buckets cut by start_time/end_time
+@pytest.mark.postgres
+@pytest.mark.parametrize("query, expected", [
+    (
+        {"aggregation": "hour", "start_time": "12:30", "end_time": "14:30"},
+        [("12:00", 30.0), ("13:00", 40.0), ("14:00", 50.0)]
+    ),
+    (
+        {"aggregation": "hour", "start_time": "12:00", "end_time": "14:00"},
+        [("12:00", 25.0), ("13:00", 40.0)]
+    ),
+    (
+        {"aggregation": "hour", "start_time": "12:15", "end_time": "12:45", "sensor_type": "temperature"},
+        [("12:00", 30.0)]
+    ),
+    (
+        {"aggregation": "day", "start_time": "13:00"},
+        [("00:00", 55.0)]
+    ),
+])
+def test_get_sensor_data_aggregated_from_rollups(client, auth_headers, sensor_data_rollups, query, expected):
+    # Days ahead, past the refresh policies' windows, so TimescaleDB aggregates
+    # these uncommitted rows in real time
+    day = datetime.now(timezone.utc).date() + timedelta(days=2)
+    
+    def at(clock):
+        return f"{day.isoformat()}T{clock}:00"
+    
+    response = client.post(
+        "/data/bulk",
+        json=[
+            {**READING, "timestamp": at(clock), "temperature": temperature}
+            for clock, temperature in [
+                ("12:10", 20.0), ("12:40", 30.0), ("13:20", 40.0),
+                ("14:20", 50.0), ("14:40", 60.0), ("16:00", 70.0)
+            ]
+        ]
     )
-    assert response.status_code in [400, 422]
+    assert response.status_code == 201
     
-    # Test invalid sensor type
-    response = client.get(
-        "/data?sensor_type=invalid_sensor",
-        headers={"Authorization": f"Bearer {token}"}
+    params = {name: at(value) if name.endswith("_time") else value for name, value in query.items()}
+    response = client.get("/data", params=params, headers=auth_headers)
+    
+    assert response.status_code == 200
+    assert [(row["timestamp"], row["temperature"]) for row in response.json()] == [
+        (at(clock), temperature) for clock, temperature in expected
+    ]
+
+
+# Test sensor_data tables keyed on id alone get "timestamp" added to the primary key.
+# The real sensor_data may already be a hypertable, which rejects a primary key
+# without "timestamp", so the upgrade runs on a scratch temporary table: temporary
+# tables come first in the search path and shadow it.
+@pytest.mark.postgres
+def test_sensor_data_primary_key_upgrade(client, db_session):
+    async def upgrade():
+        await db_session.execute(text(
+            'CREATE TEMPORARY TABLE sensor_data (id varchar PRIMARY KEY, "timestamp" timestamp NOT NULL)'
+        ))
+        await db_session.execute(text(SENSOR_DATA_PRIMARY_KEY_UPGRADE))
+        # Running it again must be a no-op
+        await db_session.execute(text(SENSOR_DATA_PRIMARY_KEY_UPGRADE))
+        result = await db_session.execute(text(
+            "SELECT a.attname FROM pg_constraint c "
+            "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey) "
+            "WHERE c.conrelid = 'sensor_data'::regclass AND c.contype = 'p' "
+            "ORDER BY a.attname"
+        ))
+        return result.scalars().all()
+    
+    assert client.portal.call(upgrade) == ["id", "timestamp"]
+
+
+# Test the startup upgrades bring a database created by an earlier version up to date
+@pytest.mark.postgres
+def test_schema_upgrades(client, db_session):
+    async def upgrade():
+        await db_session.execute(text("DROP INDEX ix_sensor_server_time"))
+        await db_session.execute(text(
+            "ALTER TABLE servers ALTER COLUMN last_seen TYPE timestamp USING last_seen AT TIME ZONE 'UTC', "
+            "ALTER COLUMN last_seen DROP DEFAULT"
+        ))
+        await db_session.execute(
+            update(DBServer.__table__)
+            .where(DBServer.server_ulid == READING["server_ulid"])
+            .values(last_seen=datetime(2025, 1, 1, 12))
+        )
+        # Running them again must be a no-op
+        for _ in range(2):
+            for statement in SCHEMA_UPGRADES:
+                await db_session.execute(text(statement))
+        index = await db_session.execute(text(
+            "SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_sensor_server_time'"
+        ))
+        last_seen = await db_session.execute(text(
+            "SELECT data_type, column_default FROM information_schema.columns "
+            "WHERE table_name = 'servers' AND column_name = 'last_seen'"
+        ))
+        seen = await db_session.execute(
+            select(DBServer.last_seen).where(DBServer.server_ulid == READING["server_ulid"])
+        )
+        return index.scalar_one(), tuple(last_seen.one()), seen.scalar_one()
+    
+    index, last_seen, seen = client.portal.call(upgrade)
+    assert index.endswith(
+        'USING btree (server_ulid, "timestamp" DESC) INCLUDE (temperature, humidity, voltage, current)'
     )
-    assert response.status_code in [400, 422]
+    assert last_seen == ("timestamp with time zone", "now()")
+    assert seen == datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
 
 
-# Additional test for server registration with unique name
-def test_create_server_with_unique_name(client):
-    token = get_auth_token(client)
-    
-    unique_name = f"Server {uuid.uuid4()}"
-    
-    response = client.post(
-        "/servers",
-        json={"server_name": unique_name},
-        headers={"Authorization": f"Bearer {token}"}
+# Test invalid parameters
+@pytest.mark.parametrize("query", [
+    "aggregation=invalid",
+    "start_time=invalid-date",
+    "sensor_type=invalid_sensor"
+])
+def test_get_sensor_data_with_invalid_parameters(client, auth_headers, query):
+    response = client.get(
+        f"/data?{query}",
+        headers=auth_headers
     )
-    assert response.status_code == 200
-    assert response.json()["server_name"] == unique_name
+    assert response.status_code in [400, 422]